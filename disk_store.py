@@ -19,24 +19,38 @@ Typical usage example:
     # it also supports dictionary style API too:
     disk["hamlet"] = "shakespeare"
 """
+import array
+import mmap
 import os.path
+import pickle
 import time
 import typing
 
-from format import KeyEntry, encode_kv, decode_kv, HEADER_SIZE, decode_header
+from format import encode_kv_bytes, HEADER_SIZE, HEADER_STRUCT, ENCODING
 
-# We use `file.seek` method to move our cursor to certain byte offset for read
-# or write operations. The method takes two parameters file.seek(offset, whence).
-# The offset says the byte offset and whence says the direction:
-#
-# whence 0 - beginning of the file
-# whence 1 - current cursor position
-# whence 2 - end of the file
-#
-# read more about it here:
-# https://docs.python.org/3.7/tutorial/inputoutput.html#methods-of-file-objects
-DEFAULT_WHENCE: typing.Final[int] = 0
+# when the writes are not synced, they are collected in memory and written to the
+# file once this many bytes are pending. Writing a few hundred bytes at a time is
+# wasteful, a bigger chunk gets us closer to the disk bandwidth
+WRITE_BUFFER_SIZE: typing.Final[int] = 64 * 1024
+
+# get maps the file again once this many bytes were written past the current mapping,
+# until then the newly written records are read with pread
+REMAP_THRESHOLD: typing.Final[int] = 1024 * 1024
 
+# on close, KeyDir is saved next to the data file in a hint file, with this extension
+HINT_FILE_EXTENSION: typing.Final[str] = ".hint"
+
+# After every write we ask the OS to persist the data to the disk. fdatasync is cheaper
+# than fsync since it skips the metadata which is not needed to read the data back
+# (like the modification time). It is not available on every platform (e.g. macOS and
+# Windows), so we fall back to fsync there.
+_sync_file: typing.Callable[[int], None] = getattr(os, "fdatasync", os.fsync)
+
+# pread reads from a given offset without a seek. It is not available on Windows, there
+# we always read through the memory mapping
+_pread: typing.Optional[typing.Callable[[int, int, int], bytes]] = getattr(
+    os, "pread", None
+)
 
 # DiskStorage is a Log-Structured Hash Table as described in the BitCask paper. We
 # keep appending the data to a file, like a log. DiskStorage maintains an in-memory
@@ -50,6 +64,21 @@ DEFAULT_WHENCE: typing.Final[int] = 0
 #
 # KeyDir does not store values, only their locations.
 #
+# Since KeyDir has an entry for every key, we keep it lean: instead of a dict of
+# key to an object holding the metadata, KeyDir maps the key to a slot number and the
+# metadata is kept in parallel arrays of plain integers, indexed by that slot:
+#
+#   key_dir         {"othello": 0, "hamlet": 1, ...}
+#   timestamps      [1652034330, 1652034331, ...]
+#   value_positions [19,         49,         ...]
+#   value_sizes     [11,         11,         ...]
+#
+# We keep the location of the value, rather than of the whole record, so that a read
+# can fetch the value straight away without decoding the record's header first.
+#
+# This saves us a Python object (and its integers) per key, and the arrays store the
+# numbers contiguously.
+#
 # The above approach solves a lot of problems:
 #   - Writes are insanely fast since you are just appending to the file
 #   - Reads are insanely fast since you do only one disk seek. In B-Tree backed
@@ -62,9 +91,32 @@ DEFAULT_WHENCE: typing.Final[int] = 0
 #       time too
 #   - Deleted keys need to be purged from the file to reduce the file size
 #
+# To cut down the startup time, on close we save KeyDir in a hint file (the idea comes
+# from the BitCask paper). On the next startup we load KeyDir from the hint file and
+# only read the records which were written to the data file after it. The hint file
+# is a pickle of KeyDir: the dict and arrays are saved and loaded by C code, which is
+# a lot faster than going through the keys one by one in Python. Note that unlike the
+# data file, the hint file is Python specific. It is only a cache, though; without it
+# we can always rebuild KeyDir from the data file.
+#
 # Read the paper for more details: https://riak.com/assets/bitcask-intro.pdf
 
 
+def _file_id(stat: os.stat_result) -> tuple[int, int]:
+    # the device and inode numbers identify a file, even if it gets renamed or another
+    # file takes over its name
+    return stat.st_dev, stat.st_ino
+
+
+class _HintUnpickler(pickle.Unpickler):
+    # loading a pickle can run arbitrary code, so we only allow the types which we
+    # save in the hint file. The dict, str, int and tuple don't need a lookup
+    def find_class(self, module: str, name: str) -> typing.Any:
+        if module == "array" and name in ("array", "_array_reconstructor"):
+            return getattr(array, name)
+        raise pickle.UnpicklingError(f"{module}.{name} is not allowed in a hint file")
+
+
 class DiskStorage:
     """
     Implements the KV store on the disk
@@ -73,32 +125,55 @@ class DiskStorage:
         file_name (str): name of the file where all the data will be written. Just
             passing the file name will save the data in the current directory. You may
             pass the full file location too.
+        sync_writes (bool): when True (the default), every set is written and synced
+            to the disk before it returns. When False, the writes are buffered in
+            memory and written out in chunks of `WRITE_BUFFER_SIZE` bytes, or when
+            `sync` or `close` is called. This is a lot faster, but the buffered writes
+            are lost if the program crashes
 
     Attributes:
         file_name (str): name of the file where all the data will be written. Just
             passing the file name will save the data in the current directory. You may
             pass the full file location too.
+        hint_file_name (str): name of the file where KeyDir is saved on close
+        sync_writes (bool): whether every set is synced to the disk
         file (typing.BinaryIO): file object pointing the file_name
         write_position (int): current cursor position in the file where the data can be
             written
-        key_dir (dict[str, KeyEntry]): is a map of key and KeyEntry being the value.
-            KeyEntry contains the position of the byte offset in the file where the
-            value exists. key_dir map acts as in-memory index to fetch the values
-            quickly from the disk
+        key_dir (dict[str, int]): is a map of key and the slot holding its metadata
+            in the `timestamps`, `value_positions` and `value_sizes` arrays. key_dir
+            map acts as in-memory index to fetch the values quickly from the disk
+        timestamps (array.array): timestamp of the latest record of each key
+        value_positions (array.array): byte offset in the file where the latest value
+            of each key exists
+        value_sizes (array.array): size of the latest value of each key
+
+    Raises:
+        ValueError: if the data file has a corrupt record
     """
 
-    def __init__(self, file_name: str = "data.db"):
+    def __init__(self, file_name: str = "data.db", sync_writes: bool = True):
         self.file_name: str = file_name
-        self.write_position: int = 0
-        self.key_dir: dict[str, KeyEntry] = {}
+        self.hint_file_name: str = file_name + HINT_FILE_EXTENSION
+        self.sync_writes: bool = sync_writes
+        # creates an empty KeyDir and sets write_position
+        self._reset_key_dir()
         # if the file exists already, then we will load the key_dir
         if os.path.exists(file_name):
             self._init_key_dir()
+        elif os.path.exists(self.hint_file_name):
+            # a hint file without its data file was left behind by an older database,
+            # it must not be used for the new data file we are about to create
+            os.remove(self.hint_file_name)
         # we open the file in `a+b` mode:
         # a - says the writes are append only. `a+` means we want append and read
         # b - says that we are operating the file in binary mode (as opposed to the
         #     default string mode)
         self.file: typing.BinaryIO = open(file_name, "a+b")
+        # read only memory mapping of the file, created lazily on the first get
+        self._mm: typing.Optional[mmap.mmap] = None
+        # writes which are not yet written to the file, when sync_writes is False
+        self._write_buffer: bytearray = bytearray()
 
     def set(self, key: str, value: str) -> None:
         """
@@ -111,15 +186,19 @@ class DiskStorage:
         # The steps to save a KV to disk is simple:
         # 1. Encode the KV into bytes
         # 2. Write the bytes to disk by appending to the file
-        # 3. Update KeyDir with the KeyEntry of this key
-        timestamp: int = int(time.time())
-        sz, data = encode_kv(timestamp=timestamp, key=key, value=value)
+        # 3. Update KeyDir with the location of this record
+        # the timestamp is in whole seconds. time_ns gives us an int straight away,
+        # which is cheaper (and exact) compared to converting the float from time()
+        timestamp: int = time.time_ns() // 1_000_000_000
+        key_bytes: bytes = key.encode(ENCODING)
+        value_bytes: bytes = value.encode(ENCODING)
+        sz, data = encode_kv_bytes(
+            timestamp=timestamp, key=key_bytes, value=value_bytes
+        )
         # notice we don't do file seek while writing
         self._write(data)
-        kv: KeyEntry = KeyEntry(
-            timestamp=timestamp, position=self.write_position, total_size=sz
-        )
-        self.key_dir[key] = kv
+        value_position: int = self.write_position + HEADER_SIZE + len(key_bytes)
+        self._update_key_dir(key, timestamp, value_position, len(value_bytes))
         # update last write position, so that next record can be written from this point
         self.write_position += sz
 
@@ -134,22 +213,85 @@ class DiskStorage:
         Returns:
             string
         """
+        return self.get_bytes(key).decode(ENCODING)
+
+    def get_bytes(self, key: str) -> bytes:
+        """
+        get_bytes retrieves the value from the disk and returns it without decoding it
+        to a string. If the key does not exist then it returns empty bytes
+
+        Args:
+            key (str): the key
+
+        Returns:
+            bytes
+        """
         # How get works?
-        # 1. Check if there is any KeyEntry record for the key in KeyDir
-        # 2. Return an empty string if key doesn't exist
-        # 3. If it exists, then read KeyEntry.total_size bytes starting from the
-        #    KeyEntry.position from the disk
-        # 4. Decode the bytes into valid KV pair and return the value
-        kv: typing.Optional[KeyEntry] = self.key_dir.get(key)
-        if not kv:
-            return ""
-        #  move the current pointer to the right offset
-        self.file.seek(kv.position, DEFAULT_WHENCE)
-        data: bytes = self.file.read(kv.total_size)
-        _, _, value = decode_kv(data)
-        return value
+        # 1. Check if there is any slot for the key in KeyDir
+        # 2. Return empty bytes if key doesn't exist
+        # 3. If it exists, then read value_sizes[slot] bytes starting from the
+        #    value_positions[slot] from the disk and return them
+        slot: typing.Optional[int] = self.key_dir.get(key)
+        if slot is None:
+            return b""
+        position: int = self.value_positions[slot]
+        end: int = position + self.value_sizes[slot]
+        # reads are served from a memory mapping of the file, so that we don't have to
+        # seek and read for every get. The mapping is only as big as the file was when
+        # we created it, so the records written after that need more work
+        mm: typing.Optional[mmap.mmap] = self._mm
+        if mm is None or end > len(mm):
+            # the record might still be in the write buffer, then we read it from there
+            buffer_position: int = self.write_position - len(self._write_buffer)
+            if position >= buffer_position:
+                start: int = position - buffer_position
+                return bytes(self._write_buffer[start : start + end - position])
+            # mapping the file again for every new record would be expensive, so we
+            # read a few recent records with pread (a single syscall, which does not
+            # move the file cursor) and only map the file again once enough new data
+            # has piled up past the mapping
+            if (
+                _pread is not None
+                and mm is not None
+                and buffer_position - len(mm) < REMAP_THRESHOLD
+            ):
+                return _pread(self.file.fileno(), end - position, position)
+            mm = self._remap()
+        return mm[position:end]
+
+    def _remap(self) -> mmap.mmap:
+        if self._mm is not None:
+            self._mm.close()
+        mm: mmap.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # reads jump around the file, so read ahead would only waste the page cache
+        if hasattr(mmap, "MADV_RANDOM"):
+            mm.madvise(mmap.MADV_RANDOM)
+        self._mm = mm
+        return mm
+
+    def sync(self) -> None:
+        """
+        sync writes out the buffered writes and makes sure that everything written so
+        far is persisted to the disk
+        """
+        self._flush_write_buffer()
+        _sync_file(self.file.fileno())
+
+    def _flush_write_buffer(self) -> None:
+        if not self._write_buffer:
+            return
+        self.file.write(self._write_buffer)
+        self.file.flush()
+        self._write_buffer.clear()
 
     def _write(self, data: bytes) -> None:
+        if not self.sync_writes:
+            # we don't write small records one by one, we collect them and write them
+            # out together once we have enough
+            self._write_buffer += data
+            if len(self._write_buffer) >= WRITE_BUFFER_SIZE:
+                self._flush_write_buffer()
+            return
         # saving stuff to a file reliably is hard!
         # if you would like to explore and learn more, then
         # start from here: https://danluu.com/file-consistency/
@@ -161,41 +303,241 @@ class DiskStorage:
         self.file.flush()
         # calling fsync after every write is important, this assures that our writes
         # are actually persisted to the disk
-        os.fsync(self.file.fileno())
+        _sync_file(self.file.fileno())
 
     def _init_key_dir(self) -> None:
         # we will initialise the key_dir by reading the contents of the file, record by
         # record. As we read each record, we will also update our KeyDir with the
-        # corresponding KeyEntry
+        # location of the record
         #
         # NOTE: this method is a blocking one, if the DB size is yuge then it will take
-        # a lot of time to startup
+        # a lot of time to startup. The hint file saves us from reading the records it
+        # already has, so we only read the ones written after it
         print("****----------initialising the database----------****")
-        with open(self.file_name, "rb") as f:
-            while header_bytes := f.read(HEADER_SIZE):
-                timestamp, key_size, value_size = decode_header(data=header_bytes)
-                key_bytes = f.read(key_size)
-                value_bytes = f.read(value_size)
-                key = key_bytes.decode("utf-8")
-                value = value_bytes.decode("utf-8")
-                total_size = HEADER_SIZE + key_size + value_size
-                kv = KeyEntry(
-                    timestamp=timestamp,
-                    position=self.write_position,
-                    total_size=total_size,
+        if self._load_hint_file():
+            try:
+                self._scan_data_file()
+                # the records after the hint file must take us to the end of the file
+                hint_is_valid = self.write_position == os.path.getsize(self.file_name)
+            except UnicodeDecodeError:
+                hint_is_valid = False
+            if not hint_is_valid:
+                # the records after the hint file don't line up with it, so the hint
+                # file can't be trusted. We drop it and read the whole data file
+                os.remove(self.hint_file_name)
+                self._reset_key_dir()
+                self._scan_data_file()
+        else:
+            self._scan_data_file()
+        # we keep track of the write position ourselves, instead of asking the file
+        # with `seek` / `tell` on every write. In append mode the OS always writes at
+        # the end of the file, so it has to end where loading the file left us.
+        # Anything after the last complete record is a partially written record. We
+        # cut it off, otherwise the records we append next would come after it and
+        # the next startup would not be able to find them
+        if os.path.getsize(self.file_name) > self.write_position:
+            # a corrupt header in the middle of the file also makes the record look
+            # incomplete, but then cutting it off would throw away all the records
+            # after it
+            if self._has_records_after(self.write_position):
+                raise ValueError(
+                    f"{self.file_name} has a corrupt record at {self.write_position}"
                 )
-                self.key_dir[key] = kv
-                self.write_position += total_size
-                print(f"loaded k={key}, v={value}")
+            os.truncate(self.file_name, self.write_position)
         print("****----------initialisation complete----------****")
 
+    def _scan_data_file(self) -> None:
+        with open(self.file_name, "rb") as f:
+            # mmap of an empty file is not allowed, and there is nothing to load anyway
+            if os.fstat(f.fileno()).st_size > self.write_position:
+                # instead of doing three small reads per record, we map the whole file
+                # in memory and walk over it by offset. This avoids a syscall per read
+                # and the extra copy from the kernel buffer
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    self._load_key_dir(mm)
+
+    def _has_records_after(self, position: int) -> bool:
+        # a partially written record is the last thing in the file, so no complete
+        # record can follow it. We look for a chain of records starting anywhere after
+        # `position`, which ends exactly at the end of the file. This is slow, but it
+        # only runs after a crash. If in doubt, we raise rather than lose any data
+        unpack_header = HEADER_STRUCT.unpack_from
+        with open(self.file_name, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                file_size: int = len(mm)
+                for start in range(position + 1, file_size - HEADER_SIZE + 1):
+                    end: int = start
+                    while end + HEADER_SIZE <= file_size:
+                        _, key_size, value_size = unpack_header(mm, end)
+                        end += HEADER_SIZE + key_size + value_size
+                    if end == file_size:
+                        return True
+        return False
+
+    def _reset_key_dir(self) -> None:
+        self.write_position: int = 0
+        self.key_dir: dict[str, int] = {}
+        # the timestamp is stored in 4 bytes on the disk, while the positions and
+        # sizes can go beyond that, so they need 8 bytes
+        self.timestamps: array.array[int] = array.array("L")
+        self.value_positions: array.array[int] = array.array("Q")
+        self.value_sizes: array.array[int] = array.array("Q")
+
+    def _load_key_dir(self, mm: mmap.mmap) -> None:
+        # we read the file front to back, tell the OS so that it can read ahead
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        file_size: int = len(mm)
+        # this loop runs for every record in the file, so it avoids any Python level
+        # function calls: the header is unpacked in place (the same as decode_header
+        # does) and KeyDir is updated inline (the same as _update_key_dir does). The
+        # methods we need are looked up once, before the loop
+        unpack_header = HEADER_STRUCT.unpack_from
+        slot_for_key = self.key_dir.setdefault
+        timestamps: array.array[int] = self.timestamps
+        value_positions: array.array[int] = self.value_positions
+        value_sizes: array.array[int] = self.value_sizes
+        position: int = self.write_position
+        # the last record might be only partially written (e.g. the program crashed in
+        # the middle of a write), so we stop at the last complete record
+        while position + HEADER_SIZE <= file_size:
+            timestamp, key_size, value_size = unpack_header(mm, position)
+            key_position: int = position + HEADER_SIZE
+            value_position: int = key_position + key_size
+            if value_position + value_size > file_size:
+                break
+            key: str = mm[key_position:value_position].decode(ENCODING)
+            new_slot: int = len(value_positions)
+            slot: int = slot_for_key(key, new_slot)
+            if slot == new_slot:
+                timestamps.append(timestamp)
+                value_positions.append(value_position)
+                value_sizes.append(value_size)
+            else:
+                timestamps[slot] = timestamp
+                value_positions[slot] = value_position
+                value_sizes[slot] = value_size
+            position = value_position + value_size
+        self.write_position = position
+
+    def _load_hint_file(self) -> bool:
+        # loads KeyDir from the hint file and returns whether it did. When it returns
+        # False, the whole data file has to be read
+        if not os.path.exists(self.hint_file_name):
+            return False
+        try:
+            with open(self.hint_file_name, "rb") as f:
+                (
+                    data_file_id,
+                    data_size,
+                    key_dir,
+                    timestamps,
+                    value_positions,
+                    value_sizes,
+                ) = _HintUnpickler(f).load()
+        except Exception:
+            # the hint file is damaged, we will read the whole data file instead. A
+            # damaged pickle can fail in many ways (e.g. MemoryError for a huge length,
+            # or AttributeError for a wrong type), and the hint file is only a cache,
+            # so any failure just means that we don't have one
+            return False
+        # a damaged hint file can still be a valid pickle, so we check that it has what
+        # we saved: a KeyDir whose slots all point into the three arrays, and whose
+        # values all lie within the data the hint file describes
+        if not (
+            isinstance(data_size, int)
+            and isinstance(key_dir, dict)
+            and isinstance(timestamps, array.array)
+            and isinstance(value_positions, array.array)
+            and isinstance(value_sizes, array.array)
+        ):
+            return False
+        # the arrays must be the same kind as the ones _reset_key_dir creates
+        if (timestamps.typecode, value_positions.typecode, value_sizes.typecode) != (
+            self.timestamps.typecode,
+            self.value_positions.typecode,
+            self.value_sizes.typecode,
+        ):
+            return False
+        n_slots: int = len(value_positions)
+        if len(timestamps) != n_slots or len(value_sizes) != n_slots:
+            return False
+        if not all(
+            type(slot) is int and 0 <= slot < n_slots for slot in key_dir.values()
+        ):
+            return False
+        if not all(
+            position + size <= data_size
+            for position, size in zip(value_positions, value_sizes)
+        ):
+            return False
+        # the hint file must have been written for this very data file, and not for
+        # another one which had the same name before. Since the data file is append
+        # only, the hint file stays valid as long as the data file still has all the
+        # bytes it describes
+        data_file_stat: os.stat_result = os.stat(self.file_name)
+        if data_file_id != _file_id(data_file_stat):
+            return False
+        if data_file_stat.st_size < data_size:
+            return False
+        self.key_dir = key_dir
+        self.timestamps = timestamps
+        self.value_positions = value_positions
+        self.value_sizes = value_sizes
+        self.write_position = data_size
+        return True
+
+    def _write_hint_file(self) -> None:
+        hint: tuple[
+            tuple[int, int],
+            int,
+            dict[str, int],
+            array.array[int],
+            array.array[int],
+            array.array[int],
+        ] = (
+            _file_id(os.stat(self.file_name)),
+            self.write_position,
+            self.key_dir,
+            self.timestamps,
+            self.value_positions,
+            self.value_sizes,
+        )
+        # we write to a temporary file and then rename it, so that a crash in the middle
+        # does not leave a half written hint file behind
+        temp_file_name: str = self.hint_file_name + ".tmp"
+        with open(temp_file_name, "wb") as f:
+            pickle.dump(hint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            _sync_file(f.fileno())
+        os.replace(temp_file_name, self.hint_file_name)
+
+    def _update_key_dir(
+        self, key: str, timestamp: int, value_position: int, value_size: int
+    ) -> None:
+        # setdefault looks up the key only once, whether it is a new key or not
+        new_slot: int = len(self.value_positions)
+        slot: int = self.key_dir.setdefault(key, new_slot)
+        if slot == new_slot:
+            # a new key, it got the next slot at the end of the arrays
+            self.timestamps.append(timestamp)
+            self.value_positions.append(value_position)
+            self.value_sizes.append(value_size)
+            return
+        # an existing key, the latest record replaces the old one in its slot
+        self.timestamps[slot] = timestamp
+        self.value_positions[slot] = value_position
+        self.value_sizes[slot] = value_size
+
     def close(self) -> None:
         # before we close the file, we need to safely write the contents in the buffers
         # to the disk. Check documentation of DiskStorage._write() to understand
         # following the operations
-        self.file.flush()
-        os.fsync(self.file.fileno())
+        self.sync()
+        if self._mm is not None:
+            self._mm.close()
         self.file.close()
+        self._write_hint_file()
 
     def __setitem__(self, key: str, value: str) -> None:
         return self.set(key, value)
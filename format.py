@@ -36,6 +36,7 @@ For the workshop, the functions will have the following signature:
     def decode_kv(data: bytes) -> tuple[int, str, str]
 """
 
+import mmap
 import struct
 import typing
 
@@ -74,13 +75,25 @@ import typing
 # `L` - represents long unsigned int (4 bytes). We have three fields, hence `LLL`
 HEADER_FORMAT: typing.Final[str] = "<LLL"
 HEADER_SIZE: typing.Final[int] = 12
+# Keys and values are strings, we store them as utf-8 bytes. For ascii data, CPython
+# decodes utf-8 as fast as it decodes latin-1 or ascii, so there is nothing to be
+# gained by choosing a "simpler" encoding, and it would break non-ascii data.
+ENCODING: typing.Final[str] = "utf-8"
+# Compiling the format string once into a `struct.Struct` object saves us from parsing
+# it again on every call. We encode/decode a header for every record we write and for
+# every record we read at startup, so this adds up.
+HEADER_STRUCT: typing.Final[struct.Struct] = struct.Struct(HEADER_FORMAT)
+
+# decode functions accept any object holding bytes, like a memory mapped file, so that
+# the callers don't have to copy the data into a bytes object first
+Buffer = typing.Union[bytes, bytearray, memoryview, mmap.mmap]
 
 
 class KeyEntry:
     """
     KeyEntry keeps the metadata about the KV, specially the position of
-    the byte offset in the file. Whenever we insert/update a key, we create a new
-    KeyEntry object and insert that into KeyDir.
+    the byte offset in the file. DiskStorage keeps the same fields in KeyDir, but
+    stores them in parallel arrays instead of one KeyEntry object per key.
 
     Args:
         timestamp (int): Timestamp at which we wrote the KV pair to the disk. The value
@@ -91,6 +104,10 @@ class KeyEntry:
             how many bytes we need to read from the file
     """
 
+    # there can be one KeyEntry for every key in the database, so we use __slots__ to
+    # get rid of the per instance __dict__ and keep the memory usage down
+    __slots__ = ("timestamp", "position", "total_size")
+
     def __init__(self, timestamp: int, position: int, total_size: int):
         self.timestamp: int = timestamp
         self.position: int = position
@@ -114,7 +131,7 @@ def encode_header(timestamp: int, key_size: int, value_size: int) -> bytes:
     Raises:
         struct.error when parameters don't match the specific type / size
     """
-    return struct.pack(HEADER_FORMAT, timestamp, key_size, value_size)
+    return HEADER_STRUCT.pack(timestamp, key_size, value_size)
 
 
 def encode_kv(timestamp: int, key: str, value: str) -> tuple[int, bytes]:
@@ -133,9 +150,37 @@ def encode_kv(timestamp: int, key: str, value: str) -> tuple[int, bytes]:
     Raises:
         struct.error when parameters don't match the specific type / size
     """
-    header: bytes = encode_header(timestamp, len(key), len(value))
-    data: bytes = b"".join([str.encode(key), str.encode(value)])
-    return HEADER_SIZE + len(data), header + data
+    return encode_kv_bytes(timestamp, key.encode(ENCODING), value.encode(ENCODING))
+
+
+def encode_kv_bytes(timestamp: int, key: bytes, value: bytes) -> tuple[int, bytes]:
+    """
+    encode_kv_bytes encodes the already encoded KV pair into a record. It is useful
+    when the caller needs the key and value bytes too, so that they are not encoded
+    twice
+
+    Args:
+        timestamp (int): Timestamp at which we wrote the KV pair to the disk. The value
+            is current time in seconds since the epoch.
+        key (bytes): the key (cannot exceed the maximum size)
+        value (bytes): the value (cannot exceed the maximum size)
+
+    Returns:
+        tuple containing the size of encoded bytes and the byte object
+
+    Raises:
+        struct.error when parameters don't match the specific type / size
+    """
+    key_size: int = len(key)
+    value_size: int = len(value)
+    # we build the record with a single join of the header, key and value. join
+    # works out the total size up front and copies each piece exactly once, and it
+    # turned out to be faster than packing everything with one format string (which
+    # has to be built for every size) or filling a pre-sized bytearray
+    data: bytes = b"".join(
+        (HEADER_STRUCT.pack(timestamp, key_size, value_size), key, value)
+    )
+    return HEADER_SIZE + key_size + value_size, data
 
 
 def decode_kv(data: bytes) -> tuple[int, str, str]:
@@ -157,21 +202,23 @@ def decode_kv(data: bytes) -> tuple[int, str, str]:
         IndexError: if the length of bytes is shorter than expected
         UnicodeDecodeError: if the key or values bytes could not be decoded to string
     """
-    timestamp, key_size, value_size = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+    timestamp, key_size, value_size = HEADER_STRUCT.unpack_from(data)
     key_bytes: bytes = data[HEADER_SIZE : HEADER_SIZE + key_size]
     value_bytes: bytes = data[HEADER_SIZE + key_size :]
-    key: str = key_bytes.decode("utf-8")
-    value: str = value_bytes.decode("utf-8")
+    key: str = key_bytes.decode(ENCODING)
+    value: str = value_bytes.decode(ENCODING)
     return timestamp, key, value
 
 
-def decode_header(data: bytes) -> tuple[int, int, int]:
+def decode_header(data: Buffer, offset: int = 0) -> tuple[int, int, int]:
     """
     decode_header decodes the bytes into header using the `HEADER_FORMAT` format
     string
 
     Args:
         data (bytes): byte object containing the encoded header data
+        offset (int): byte offset in data where the header starts. This lets us read
+            a header from a larger buffer (like a whole file) without slicing it
 
     Returns:
         A tuple containing:
@@ -183,5 +230,5 @@ def decode_header(data: bytes) -> tuple[int, int, int]:
     Raises:
         struct.error: when parameters don't match the specific type / size
     """
-    timestamp, key_size, value_size = struct.unpack(HEADER_FORMAT, data)
+    timestamp, key_size, value_size = HEADER_STRUCT.unpack_from(data, offset)
     return timestamp, key_size, value_size
@@ -0,0 +1,143 @@
+"""
+sharded_store module implements ShardedDiskStorage class which spreads the KV store
+over multiple DiskStorage instances
+
+DiskStorage supports a single thread only. ShardedDiskStorage splits the keys into a
+fixed number of shards, each one being a DiskStorage with its own data file and
+KeyDir. Every key always goes to the same shard, so the shards don't share anything
+and the operations on different shards can run in parallel from multiple threads.
+
+Typical usage example:
+
+    store: ShardedDiskStorage = ShardedDiskStorage(dir_name="books", n_shards=4)
+    store.set(key="othello", value="shakespeare")
+    author: str = store.get("othello")
+    # it also supports dictionary style API too:
+    store["hamlet"] = "shakespeare"
+"""
+import os
+import threading
+import typing
+import zlib
+
+from disk_store import DiskStorage
+from format import ENCODING
+
+# each shard keeps its data in a file named after its number, inside the directory
+SHARD_FILE_NAME: typing.Final[str] = "shard_{}.db"
+
+# the keys are spread over the shards by their number, so the directory can only be
+# opened with the number of shards it was created with. We save it in this file
+SHARD_COUNT_FILE_NAME: typing.Final[str] = "shards"
+
+
+class ShardedDiskStorage:
+    """
+    Implements the KV store on the disk, split into multiple shards
+
+    Args:
+        dir_name (str): name of the directory where the shard files will be written.
+            It is created if it does not exist
+        n_shards (int): number of shards. A key is always stored in the same shard,
+            so a directory has to be opened with the same number of shards every time.
+            The number is saved in the directory when it is created
+        sync_writes (bool): passed to every shard, check DiskStorage for the details
+
+    Attributes:
+        dir_name (str): name of the directory where the shard files are written
+        shards (list[DiskStorage]): the shards, indexed by the shard number
+
+    Raises:
+        ValueError: if n_shards is less than 1, or the directory was created with a
+            different number of shards
+    """
+
+    def __init__(
+        self, dir_name: str = "data", n_shards: int = 4, sync_writes: bool = True
+    ):
+        if n_shards < 1:
+            raise ValueError(f"n_shards must be at least 1, got {n_shards}")
+        self.dir_name: str = dir_name
+        os.makedirs(dir_name, exist_ok=True)
+        self._check_shard_count(n_shards)
+        self.shards: list[DiskStorage] = [
+            DiskStorage(
+                file_name=os.path.join(dir_name, SHARD_FILE_NAME.format(i)),
+                sync_writes=sync_writes,
+            )
+            for i in range(n_shards)
+        ]
+        # a DiskStorage must only be used by one thread at a time, so each shard has
+        # its own lock. Threads working on different shards don't wait for each other
+        self._locks: list[threading.Lock] = [threading.Lock() for _ in self.shards]
+
+    def _check_shard_count(self, n_shards: int) -> None:
+        shard_count_path: str = os.path.join(self.dir_name, SHARD_COUNT_FILE_NAME)
+        if os.path.exists(shard_count_path):
+            with open(shard_count_path) as f:
+                saved_n_shards: int = int(f.read())
+            if saved_n_shards != n_shards:
+                raise ValueError(
+                    f"{self.dir_name} has {saved_n_shards} shards, got {n_shards}"
+                )
+            return
+        # a new directory. We save the number before any shard is created, and write
+        # it to a temporary file first, so that a crash can't leave a half written one
+        temp_path: str = shard_count_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(str(n_shards))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, shard_count_path)
+
+    def _shard_number(self, key: str) -> int:
+        # we can't use the built-in `hash`, since it is randomised for every run of
+        # the program and the keys must land on the same shard after a restart
+        return zlib.crc32(key.encode(ENCODING)) % len(self.shards)
+
+    def set(self, key: str, value: str) -> None:
+        """
+        set stores the key and value on the disk, in the shard the key belongs to
+
+        Args:
+            key (str): the key
+            value (str): the value
+        """
+        n: int = self._shard_number(key)
+        with self._locks[n]:
+            self.shards[n].set(key, value)
+
+    def get(self, key: str) -> str:
+        """
+        get retrieves the value from the shard the key belongs to. If the key does not
+        exist then it returns an empty string
+
+        Args:
+            key (str): the key
+
+        Returns:
+            string
+        """
+        n: int = self._shard_number(key)
+        with self._locks[n]:
+            return self.shards[n].get(key)
+
+    def sync(self) -> None:
+        """
+        sync makes sure that everything written so far to any of the shards is
+        persisted to the disk
+        """
+        for lock, shard in zip(self._locks, self.shards):
+            with lock:
+                shard.sync()
+
+    def close(self) -> None:
+        for lock, shard in zip(self._locks, self.shards):
+            with lock:
+                shard.close()
+
+    def __setitem__(self, key: str, value: str) -> None:
+        return self.set(key, value)
+
+    def __getitem__(self, item: str) -> str:
+        return self.get(item)
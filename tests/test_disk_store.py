@@ -1,9 +1,12 @@
+import array
 import os
+import pickle
 import tempfile
 import typing
 import unittest
 
-from disk_store import DiskStorage
+from disk_store import DiskStorage, HINT_FILE_EXTENSION
+from format import encode_kv, HEADER_SIZE
 
 
 class TempStorageFile:
@@ -37,6 +40,10 @@ class TempStorageFile:
         # will delete our database file. Having a separate method would give us better
         # control.
         os.remove(self.path)
+        # DiskStorage saves its KeyDir next to the data file on close
+        hint_path: str = self.path + HINT_FILE_EXTENSION
+        if os.path.exists(hint_path):
+            os.remove(hint_path)
 
 
 class TestDiskCaskDB(unittest.TestCase):
@@ -52,6 +59,13 @@ class TestDiskCaskDB(unittest.TestCase):
         self.assertEqual(store.get("name"), "jojo")
         store.close()
 
+    def test_get_bytes(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("name", "jöjo")
+        self.assertEqual(store.get_bytes("name"), "jöjo".encode("utf-8"))
+        self.assertEqual(store.get_bytes("some key"), b"")
+        store.close()
+
     def test_invalid_key(self) -> None:
         store = DiskStorage(file_name=self.file.path)
         self.assertEqual(store.get("some key"), "")
@@ -110,6 +124,246 @@ class TestDiskCaskDB(unittest.TestCase):
         self.assertEqual(store.get("end"), "yes")
         store.close()
 
+    def test_buffered_writes(self) -> None:
+        store = DiskStorage(file_name=self.file.path, sync_writes=False)
+        store.set("hamlet", "shakespeare")
+        # the write is still buffered, but it should be readable
+        self.assertEqual(os.path.getsize(self.file.path), 0)
+        self.assertEqual(store.get("hamlet"), "shakespeare")
+
+        store.set("dune", "frank herbert")
+        store.sync()
+        self.assertEqual(os.path.getsize(self.file.path), store.write_position)
+
+        tests = {f"key-{i}": f"value-{i}" for i in range(10000)}
+        for k, v in tests.items():
+            store.set(k, v)
+        store.close()
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "shakespeare")
+        self.assertEqual(store.get("dune"), "frank herbert")
+        for k, v in tests.items():
+            self.assertEqual(store.get(k), v)
+        store.close()
+
+    def partial_write_test(self, written: int) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "shakespeare")
+        store.close()
+        os.remove(self.file.path + HINT_FILE_EXTENSION)
+
+        # only the first few bytes of a record made it to the disk
+        _, data = encode_kv(timestamp=10, key="othello", value="shakespeare")
+        with open(self.file.path, "ab") as f:
+            f.write(data[:written])
+
+        store = DiskStorage(file_name=self.file.path)
+        store.set("dune", "frank herbert")
+        store.set("war and peace", "tolstoy")
+        self.assertEqual(store.get("hamlet"), "shakespeare")
+        self.assertEqual(store.get("dune"), "frank herbert")
+        store.close()
+
+        # the records written after the partial one must be found without the help
+        # of a hint file too
+        os.remove(self.file.path + HINT_FILE_EXTENSION)
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "shakespeare")
+        self.assertEqual(store.get("dune"), "frank herbert")
+        self.assertEqual(store.get("war and peace"), "tolstoy")
+        self.assertEqual(store.get("othello"), "")
+        store.close()
+
+    def test_partial_write(self) -> None:
+        self.partial_write_test(written=HEADER_SIZE + 4)
+
+    def test_partial_header(self) -> None:
+        self.partial_write_test(written=HEADER_SIZE // 2)
+
+    def test_corrupt_record(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        tests = {f"key-{i}": f"value-{i}" for i in range(1000)}
+        for k, v in tests.items():
+            store.set(k, v)
+        value_position: int = store.value_positions[store.key_dir["key-2"]]
+        store.close()
+        os.remove(self.file.path + HINT_FILE_EXTENSION)
+
+        # the value size of a record in the middle of the file gets corrupted, so the
+        # record seems to run past the end of the file
+        size_position: int = value_position - len("key-2") - 1
+        with open(self.file.path, "r+b") as f:
+            f.seek(size_position)
+            original: bytes = f.read(1)
+            f.seek(size_position)
+            f.write(b"\x7f")
+        file_size: int = os.path.getsize(self.file.path)
+        self.assertRaises(ValueError, DiskStorage, self.file.path)
+        self.assertEqual(os.path.getsize(self.file.path), file_size)
+
+        # once the record is repaired, all the records after it are still there
+        with open(self.file.path, "r+b") as f:
+            f.seek(size_position)
+            f.write(original)
+        store = DiskStorage(file_name=self.file.path)
+        for k, v in tests.items():
+            self.assertEqual(store.get(k), v)
+        store.close()
+
+    def test_hint_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "shakespeare")
+        store.set("dune", "frank herbert")
+        store.set("hamlet", "william shakespeare")
+        store.close()
+        self.assertTrue(os.path.exists(self.file.path + HINT_FILE_EXTENSION))
+
+        # records written after the hint file should be read from the data file
+        _, data = encode_kv(timestamp=10, key="othello", value="shakespeare")
+        with open(self.file.path, "ab") as f:
+            f.write(data)
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "william shakespeare")
+        self.assertEqual(store.get("dune"), "frank herbert")
+        self.assertEqual(store.get("othello"), "shakespeare")
+        store.close()
+
+    def test_stale_hint_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "shakespeare")
+        store.close()
+
+        # the hint file describes more data than the data file has, so it must be
+        # ignored
+        with open(self.file.path, "wb") as f:
+            f.write(encode_kv(timestamp=10, key="dune", value="herbert")[1])
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "")
+        self.assertEqual(store.get("dune"), "herbert")
+        store.close()
+
+    def test_bad_hint_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "shakespeare")
+        store.set("dune", "frank herbert")
+        store.close()
+
+        # a damaged hint file, or one with objects that we don't save, must be
+        # ignored
+        with open(self.file.path + HINT_FILE_EXTENSION, "rb") as f:
+            data_file_id, data_size, key_dir, timestamps, positions, sizes = (
+                pickle.load(f)
+            )
+        hints: typing.List[bytes] = [
+            b"garbage",
+            pickle.dumps((0, os.getcwd, 1, 2, 3)),
+            # appends to an int, which fails with an AttributeError
+            b"\x80\x04K\x01(K\x02e.",
+            # valid pickles, but not what we save
+            pickle.dumps((data_file_id, data_size, [], timestamps, positions, sizes)),
+            pickle.dumps((data_file_id, data_size, key_dir, [1], positions, sizes)),
+            pickle.dumps(
+                (data_file_id, data_size, key_dir, timestamps, positions, sizes[:0])
+            ),
+            pickle.dumps(
+                (data_file_id, data_size, {"hamlet": 5}, timestamps, positions, sizes)
+            ),
+            pickle.dumps(
+                (data_file_id, data_size, {"hamlet": "0"}, timestamps, positions, sizes)
+            ),
+            # the arrays are of a different kind, or the value runs past the data
+            pickle.dumps(
+                (data_file_id, data_size, key_dir, timestamps, positions, timestamps)
+            ),
+            pickle.dumps(
+                (
+                    data_file_id,
+                    data_size,
+                    key_dir,
+                    timestamps,
+                    positions,
+                    array.array("Q", (size + 1 for size in sizes)),
+                )
+            ),
+        ]
+        for hint in hints:
+            with open(self.file.path + HINT_FILE_EXTENSION, "wb") as f:
+                f.write(hint)
+            store = DiskStorage(file_name=self.file.path)
+            self.assertEqual(store.get("hamlet"), "shakespeare")
+            self.assertEqual(store.get("dune"), "frank herbert")
+            store.close()
+
+    def test_hint_file_without_data_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "shakespeare")
+        store.close()
+
+        # the data file is gone, but its hint file is left behind
+        os.remove(self.file.path)
+        store = DiskStorage(file_name=self.file.path)
+        self.assertFalse(os.path.exists(self.file.path + HINT_FILE_EXTENSION))
+        for i in range(10):
+            store.set(f"key-{i}", f"value-{i}")
+        # the program crashes, so close is never called and there is no new hint file
+        store.sync()
+        store.file.close()
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "")
+        for i in range(10):
+            self.assertEqual(store.get(f"key-{i}"), f"value-{i}")
+        store.close()
+
+    def test_replaced_data_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "shakespeare")
+        store.close()
+
+        # another database takes over the name, the hint file does not belong to it.
+        # Its first record has the same size, so the records after the hint line up
+        other = TempStorageFile()
+        store = DiskStorage(file_name=other.path)
+        store.set("orwell", "nineteen-84")
+        for i in range(10):
+            store.set(f"key-{i}", f"value-{i}")
+        store.close()
+        os.replace(other.path, self.file.path)
+        os.remove(other.path + HINT_FILE_EXTENSION)
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "")
+        self.assertEqual(store.get("orwell"), "nineteen-84")
+        for i in range(10):
+            self.assertEqual(store.get(f"key-{i}"), f"value-{i}")
+        store.close()
+
+    def test_misaligned_hint_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        # the value looks like the start of a record with a key which is not utf-8
+        store.set("hamlet", encode_kv(0, "k", "")[1][:HEADER_SIZE].decode() + "k")
+        store.set("dune", "frank herbert")
+        value_position: int = store.value_positions[store.key_dir["hamlet"]]
+        store.close()
+
+        # make the hint file claim that the data file has only the bytes up to the
+        # value, and break the key of the fake record
+        hint_path: str = self.file.path + HINT_FILE_EXTENSION
+        with open(hint_path, "rb") as f:
+            hint = pickle.load(f)
+        with open(hint_path, "wb") as f:
+            pickle.dump((hint[0], value_position) + hint[2:], f)
+        with open(self.file.path, "r+b") as f:
+            f.seek(value_position + HEADER_SIZE)
+            f.write(b"\xff")
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("dune"), "frank herbert")
+        store.close()
+
 
 class TestDiskCaskDBExistingFile(unittest.TestCase):
     def test_get_new_file(self) -> None:
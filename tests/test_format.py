@@ -6,6 +6,7 @@ import unittest
 import uuid
 
 from format import encode_header, decode_header, encode_kv, decode_kv, HEADER_SIZE
+from format import encode_kv_bytes
 from format import KeyEntry
 
 
@@ -79,6 +80,8 @@ class TestEncodeKV(unittest.TestCase):
         tests: typing.List[KeyValue] = [
             KeyValue(10, "hello", "world", HEADER_SIZE + 10),
             KeyValue(0, "", "", HEADER_SIZE),
+            # sizes are in bytes, not characters
+            KeyValue(10, "héllo", "wörld", HEADER_SIZE + 12),
         ]
         for tt in tests:
             self.kv_test(tt)
@@ -88,6 +91,11 @@ class TestEncodeKV(unittest.TestCase):
             tt = KeyValue(*get_random_kv())
             self.kv_test(tt)
 
+    def test_bytes(self) -> None:
+        self.assertEqual(
+            encode_kv_bytes(10, b"hello", b"world"), encode_kv(10, "hello", "world")
+        )
+
 
 class TestKeyEntry(unittest.TestCase):
     # dumb test to increase the coverage
@@ -96,3 +104,7 @@ class TestKeyEntry(unittest.TestCase):
         self.assertEqual(ke.timestamp, 10)
         self.assertEqual(ke.position, 10)
         self.assertEqual(ke.total_size, 10)
+
+    def test_no_dict(self) -> None:
+        ke = KeyEntry(10, 10, 10)
+        self.assertFalse(hasattr(ke, "__dict__"))
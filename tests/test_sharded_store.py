@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from sharded_store import ShardedDiskStorage, SHARD_FILE_NAME
+
+
+class TestShardedCaskDB(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_name: str = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir_name)
+
+    def test_get(self) -> None:
+        store = ShardedDiskStorage(dir_name=self.dir_name)
+        store.set("name", "jojo")
+        self.assertEqual(store.get("name"), "jojo")
+        store.close()
+
+    def test_invalid_key(self) -> None:
+        store = ShardedDiskStorage(dir_name=self.dir_name)
+        self.assertEqual(store.get("some key"), "")
+        store.close()
+
+    def test_dict_api(self) -> None:
+        store = ShardedDiskStorage(dir_name=self.dir_name)
+        store["name"] = "jojo"
+        self.assertEqual(store["name"], "jojo")
+        store.close()
+
+    def test_invalid_shards(self) -> None:
+        self.assertRaises(ValueError, ShardedDiskStorage, self.dir_name, 0)
+
+    def test_persistence(self) -> None:
+        store = ShardedDiskStorage(dir_name=self.dir_name, n_shards=3)
+        tests = {f"key-{i}": f"value-{i}" for i in range(100)}
+        for k, v in tests.items():
+            store.set(k, v)
+        store.close()
+
+        for i in range(3):
+            path = os.path.join(self.dir_name, SHARD_FILE_NAME.format(i))
+            self.assertGreater(os.path.getsize(path), 0)
+
+        store = ShardedDiskStorage(dir_name=self.dir_name, n_shards=3)
+        for k, v in tests.items():
+            self.assertEqual(store.get(k), v)
+        store.close()
+
+    def test_wrong_shards(self) -> None:
+        store = ShardedDiskStorage(dir_name=self.dir_name, n_shards=3)
+        store.set("name", "jojo")
+        store.close()
+
+        # with a different number of shards the keys would be looked up in the wrong
+        # shard, so the directory must not be opened
+        self.assertRaises(ValueError, ShardedDiskStorage, self.dir_name)
+        self.assertRaises(ValueError, ShardedDiskStorage, self.dir_name, 2)
+
+        store = ShardedDiskStorage(dir_name=self.dir_name, n_shards=3)
+        self.assertEqual(store.get("name"), "jojo")
+        store.close()
+
+    def test_threads(self) -> None:
+        store = ShardedDiskStorage(dir_name=self.dir_name, sync_writes=False)
+        # assertions don't work from other threads, so we collect the bad reads
+        bad_reads: list[str] = []
+
+        def worker(n: int) -> None:
+            for i in range(500):
+                store.set(f"{n}-{i}", f"value-{n}-{i}")
+                if store.get(f"{n}-{i}") != f"value-{n}-{i}":
+                    bad_reads.append(f"{n}-{i}")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(bad_reads, [])
+
+        store.sync()
+        for n in range(8):
+            for i in range(500):
+                self.assertEqual(store.get(f"{n}-{i}"), f"value-{n}-{i}")
+        store.close()